@@ -1,8 +1,17 @@
 import asyncio
+import logging
+import logging.handlers
 import os
+import queue
+import re
+import sys
+import time
+import typing
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 
+import msgspec
 from aiohttp import web
 from telegram import (
     InlineKeyboardButton,
@@ -15,6 +24,7 @@ from telegram import (
 from telegram.constants import ParseMode
 from telegram.error import BadRequest, Forbidden
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     ApplicationBuilder,
     BusinessConnectionHandler,
@@ -23,6 +33,7 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
 
 
 # ========================
@@ -42,6 +53,10 @@ except Exception:
     pass
 
 
+logger = logging.getLogger("clara")
+logger.setLevel(logging.INFO)
+
+
 def _getenv(name: str) -> Optional[str]:
     return os.getenv(name)
 
@@ -73,7 +88,24 @@ def _load_settings() -> Settings:
 
 
 SETTINGS = _load_settings()
-COMBO_DISPATCHED_CHATS = set()
+
+# LRU limitado de chats que já receberam o combo (evita crescer para sempre)
+_MAX_DISPATCHED = 100_000
+COMBO_DISPATCHED_CHATS: typing.OrderedDict[int, None] = OrderedDict()
+
+
+def _combo_already_dispatched(chat_id: int) -> bool:
+    if chat_id in COMBO_DISPATCHED_CHATS:
+        COMBO_DISPATCHED_CHATS.move_to_end(chat_id)
+        return True
+    return False
+
+
+def _mark_combo_dispatched(chat_id: int) -> None:
+    COMBO_DISPATCHED_CHATS[chat_id] = None
+    COMBO_DISPATCHED_CHATS.move_to_end(chat_id)
+    while len(COMBO_DISPATCHED_CHATS) > _MAX_DISPATCHED:
+        COMBO_DISPATCHED_CHATS.popitem(last=False)
 
 
 # ========================
@@ -81,10 +113,14 @@ COMBO_DISPATCHED_CHATS = set()
 # ========================
 
 
+_BLOCK_RE = re.compile(r"blocked|deactivated|chat not found", re.IGNORECASE)
+
+
 async def _handle_blocking_exception(user_id: Optional[int], exc: Exception) -> None:
-    text = str(exc).lower()
-    if any(x in text for x in ("blocked", "deactivated", "chat not found")):
-        print(f"Usuário {user_id} bloqueou o bot ou chat indisponível.")
+    # TelegramError expõe .message; a regex case-insensitive evita o .lower()
+    text = getattr(exc, "message", None) or str(exc)
+    if _BLOCK_RE.search(text):
+        logger.info("Usuário %s bloqueou o bot ou chat indisponível.", user_id)
 
 
 async def _safe_reply_text(
@@ -95,14 +131,14 @@ async def _safe_reply_text(
     reply_markup: Optional[InlineKeyboardMarkup] = None,
 ) -> Optional[Message]:
     try:
-        business_connection_id = getattr(message, "business_connection_id", None)
         return await message.reply_text(
             text=text,
             parse_mode=parse_mode,
             reply_markup=reply_markup,
-            business_connection_id=business_connection_id,
+            business_connection_id=message.business_connection_id,
         )
     except TypeError:
+        # Caminho lento, só em versões do PTB sem business_connection_id no reply
         try:
             bot = None
             try:
@@ -111,7 +147,7 @@ async def _safe_reply_text(
                 bot = getattr(message, "bot", None) or getattr(message, "_bot", None)
             chat = getattr(message, "chat", None)
             chat_id = getattr(message, "chat_id", None) or (chat.id if chat else None)
-            bcid = getattr(message, "business_connection_id", None)
+            bcid = message.business_connection_id
             if bot and chat_id is not None:
                 return await bot.send_message(
                     chat_id=chat_id,
@@ -125,28 +161,14 @@ async def _safe_reply_text(
         except Exception:
             return None
     except (Forbidden, BadRequest) as exc:
-        await _handle_blocking_exception(getattr(message, "from_user", None) and message.from_user.id, exc)
+        from_user = message.from_user
+        await _handle_blocking_exception(from_user.id if from_user else None, exc)
         return None
 
 
-async def _safe_send_message(
-    bot,
-    *,
-    chat_id: int,
-    user_id: Optional[int],
-    text: str,
-    parse_mode: Optional[str] = None,
-    reply_markup: Optional[InlineKeyboardMarkup] = None,
-    business_connection_id: Optional[str] = None,
-) -> Optional[Message]:
+async def _safe_call(coro_factory: Callable[[], Awaitable[Any]], user_id: Optional[int]) -> Any:
     try:
-        return await bot.send_message(
-            chat_id=chat_id,
-            text=text,
-            parse_mode=parse_mode,
-            reply_markup=reply_markup,
-            business_connection_id=business_connection_id,
-        )
+        return await coro_factory()
     except (Forbidden, BadRequest) as exc:
         await _handle_blocking_exception(user_id, exc)
         return None
@@ -170,73 +192,29 @@ async def _safe_delete_message_by_id(bot, chat_id: Optional[int], message_id: Op
         pass
 
 
-async def _safe_send_photo(
-    bot,
-    *,
-    chat_id: int,
-    user_id: Optional[int],
-    photo,
-    caption: Optional[str] = None,
-    parse_mode: Optional[str] = None,
-    business_connection_id: Optional[str] = None,
-):
-    try:
-        return await bot.send_photo(
-            chat_id=chat_id,
-            photo=photo,
-            caption=caption,
-            parse_mode=parse_mode,
-            business_connection_id=business_connection_id,
-        )
-    except (Forbidden, BadRequest) as exc:
-        await _handle_blocking_exception(user_id, exc)
-        return None
-
-
-async def _safe_send_video(
-    bot,
-    *,
-    chat_id: int,
-    user_id: Optional[int],
-    video,
-    caption: Optional[str] = None,
-    parse_mode: Optional[str] = None,
-    business_connection_id: Optional[str] = None,
-):
-    try:
-        return await bot.send_video(
-            chat_id=chat_id,
-            video=video,
-            caption=caption,
-            parse_mode=parse_mode,
-            business_connection_id=business_connection_id,
-        )
-    except (Forbidden, BadRequest) as exc:
-        await _handle_blocking_exception(user_id, exc)
-        return None
-
-
-async def _safe_send_audio(
-    bot,
-    *,
-    chat_id: int,
-    user_id: Optional[int],
-    audio,
-    caption: Optional[str] = None,
-    parse_mode: Optional[str] = None,
-    business_connection_id: Optional[str] = None,
-):
-    try:
-        return await bot.send_audio(
-            chat_id=chat_id,
-            audio=audio,
-            caption=caption,
-            parse_mode=parse_mode,
-            business_connection_id=business_connection_id,
-        )
-    except (Forbidden, BadRequest) as exc:
-        await _handle_blocking_exception(user_id, exc)
-        return None
+# file_id -> (url, expira_em). Os links de download do Telegram valem por ~1h,
+# então o cache expira antes disso
+VOICE_URL_TTL_SECONDS = 50 * 60
+_VOICE_URL_CACHE: Dict[str, Tuple[str, float]] = {}
+_VOICE_URL_LOCKS: Dict[str, asyncio.Lock] = {}
+
+
+async def _resolve_voice_url(bot, voice: str) -> Optional[str]:
+    cached = _VOICE_URL_CACHE.get(voice)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    # Um get_file por file_id mesmo com vários envios falhando ao mesmo tempo
+    async with _VOICE_URL_LOCKS.setdefault(voice, asyncio.Lock()):
+        cached = _VOICE_URL_CACHE.get(voice)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        tg_file = await bot.get_file(voice)
+        # O PTB já devolve file_path como URL absoluta de download
+        file_url = tg_file.file_path
+        if not file_url:
+            return None
+        _VOICE_URL_CACHE[voice] = (file_url, time.monotonic() + VOICE_URL_TTL_SECONDS)
+        return file_url
 
 
 async def _safe_send_voice_prefer(
@@ -260,10 +238,8 @@ async def _safe_send_voice_prefer(
     except (Forbidden, BadRequest) as exc:
         try:
             if isinstance(voice, str):
-                tg_file = await bot.get_file(voice)
-                file_path = getattr(tg_file, "file_path", None)
-                if file_path:
-                    file_url = f"https://api.telegram.org/file/bot{SETTINGS.token}/{str(file_path).lstrip('/')}"
+                file_url = await _resolve_voice_url(bot, voice)
+                if file_url:
                     try:
                         return await bot.send_voice(
                             chat_id=chat_id,
@@ -276,36 +252,16 @@ async def _safe_send_voice_prefer(
                         pass
         except Exception:
             pass
-        try:
-            return await bot.send_audio(
+        return await _safe_call(
+            lambda: bot.send_audio(
                 chat_id=chat_id,
                 audio=voice,
                 caption=caption,
                 parse_mode=parse_mode,
                 business_connection_id=business_connection_id,
-            )
-        except (Forbidden, BadRequest) as exc2:
-            await _handle_blocking_exception(user_id, exc2)
-            return None
-
-
-async def _safe_send_media_group(
-    bot,
-    *,
-    chat_id: int,
-    user_id: Optional[int],
-    media: list,
-    business_connection_id: Optional[str] = None,
-):
-    try:
-        return await bot.send_media_group(
-            chat_id=chat_id,
-            media=media,
-            business_connection_id=business_connection_id,
+            ),
+            user_id,
         )
-    except (Forbidden, BadRequest) as exc:
-        await _handle_blocking_exception(user_id, exc)
-        return None
 
 
 # ========================
@@ -313,29 +269,39 @@ async def _safe_send_media_group(
 # ========================
 
 
-# IDs de mídia Beatriz
-BEATRIZ_COMBO_FOTO_1 = _getenv("BEATRIZ_COMBO_FOTO_1")
-BEATRIZ_COMBO_FOTO_2 = _getenv("BEATRIZ_COMBO_FOTO_2")
-BEATRIZ_COMBO_FOTO_3 = _getenv("BEATRIZ_COMBO_FOTO_3")
-BEATRIZ_COMBO_FOTO_4 = _getenv("BEATRIZ_COMBO_FOTO_4")
-BEATRIZ_COMBO_FOTO_5 = _getenv("BEATRIZ_COMBO_FOTO_5")
-BEATRIZ_COMBO_FOTO_6 = _getenv("BEATRIZ_COMBO_FOTO_6")
-BEATRIZ_COMBO_FOTO_7 = _getenv("BEATRIZ_COMBO_FOTO_7")
-BEATRIZ_COMBO_FOTO_8 = _getenv("BEATRIZ_COMBO_FOTO_8")
-BEATRIZ_COMBO_FOTO_9 = _getenv("BEATRIZ_COMBO_FOTO_9")
-BEATRIZ_COMBO_FOTO_10 = _getenv("BEATRIZ_COMBO_FOTO_10")
+@dataclass(frozen=True)
+class MediaSettings:
+    combo_photos: Tuple[str, ...]
+    combo_videos: Tuple[str, ...]
+    audio_delivery: Optional[str]
+    audio_post_delivery: Optional[str]
+    audio_upsell_offer: Optional[str]
+    video_vip_preview: Optional[str]
+    audio_remarketing: Optional[str]
+    audio_remarketing_2: Optional[str]
+
+
+def _load_media_settings() -> MediaSettings:
+    # IDs de mídia Beatriz; fotos/vídeos vazios já saem filtrados
+    photos = (_getenv(f"BEATRIZ_COMBO_FOTO_{i}") for i in range(1, 11))
+    videos = (_getenv(f"BEATRIZ_COMBO_VIDEO_{i}") for i in range(1, 5))
+    return MediaSettings(
+        combo_photos=tuple(pid for pid in photos if pid),
+        combo_videos=tuple(vid for vid in videos if vid),
+        audio_delivery=_getenv("AUDIO_ENTREGA_COMBO"),
+        audio_post_delivery=_getenv("AUDIO_POS_ENTREGA_COMBO"),
+        audio_upsell_offer=_getenv("AUDIO_OFERTANDO_UPSELL"),
+        video_vip_preview=_getenv("VIDEO_PREVIA_VIP"),
+        audio_remarketing=_getenv("AUDIO_REMARKETING_UPSELL"),
+        audio_remarketing_2=_getenv("AUDIO_REMARKETING_UPSELL_2"),
+    )
 
-BEATRIZ_COMBO_VIDEO_1 = _getenv("BEATRIZ_COMBO_VIDEO_1")
-BEATRIZ_COMBO_VIDEO_2 = _getenv("BEATRIZ_COMBO_VIDEO_2")
-BEATRIZ_COMBO_VIDEO_3 = _getenv("BEATRIZ_COMBO_VIDEO_3")
-BEATRIZ_COMBO_VIDEO_4 = _getenv("BEATRIZ_COMBO_VIDEO_4")
 
-AUDIO_ENTREGA_COMBO = _getenv("AUDIO_ENTREGA_COMBO")
-AUDIO_POS_ENTREGA_COMBO = _getenv("AUDIO_POS_ENTREGA_COMBO")
-AUDIO_OFERTANDO_UPSELL = _getenv("AUDIO_OFERTANDO_UPSELL")
-VIDEO_PREVIA_VIP = _getenv("VIDEO_PREVIA_VIP")
-AUDIO_REMARKETING_UPSELL = _getenv("AUDIO_REMARKETING_UPSELL")
-AUDIO_REMARKETING_UPSELL_2 = _getenv("AUDIO_REMARKETING_UPSELL_2")
+MEDIA = _load_media_settings()
+
+# Fixos desde o startup: monta as mídias do combo uma única vez
+PHOTO_MEDIA = tuple(InputMediaPhoto(media=pid) for pid in MEDIA.combo_photos)
+VIDEO_MEDIA = tuple(InputMediaVideo(media=vid) for vid in MEDIA.combo_videos)
 
 
 # ========================
@@ -348,15 +314,33 @@ VIP_LINK_6_MESES = "https://global.tribopay.com.br/kgwjs"
 VIP_LINK_1_ANO = "https://global.tribopay.com.br/1fhtd"
 EU_QUERO_LINK = "https://global.tribopay.com.br/zjvj6"
 
+VIP_KEYBOARD = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("[$10]1 MONTH🔥", url=VIP_LINK_1_MES)],
+        [InlineKeyboardButton("[$17]6 MONTHS+SURPRISE👀🔥", url=VIP_LINK_6_MESES)],
+        [InlineKeyboardButton("[$20]1 YEAR+EXCLUSIVE VIDEO+🎁", url=VIP_LINK_1_ANO)],
+    ]
+)
+EU_QUERO_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("I WANT THIS 🔥", url=EU_QUERO_LINK)]])
+
 AUTO_REPLY_DELAY_SECONDS = 30
 VIP_OFFER_DELAY_SECONDS = 180
+REMARKETING_VOICE_2_DELAY_SECONDS = 45
 GROUP_CHECK_INTERVAL_SECONDS = 60
-GROUP_CHECK_MAX_ATTEMPTS = 5
+# Janela total antes do remarketing (a mesma de 5 verificações a cada 60s)
+GROUP_CHECK_WINDOW_SECONDS = 300
 GROUP_APPROVED_MESSAGE = "I accepted you into the group, I hope you like it."
 
 
+def _schedule_once(jobq, callback, *, when: float, data: dict, name: str) -> None:
+    # Um job por nome: substitui o agendamento anterior em vez de empilhar
+    for existing in jobq.get_jobs_by_name(name):
+        existing.schedule_removal()
+    jobq.run_once(callback, when=when, data=data, name=name)
+
+
 async def _combo_delivery_beatriz_job(context: ContextTypes.DEFAULT_TYPE) -> None:
-    job = getattr(context, "job", None)
+    job = context.job
     data = job.data if job else {}
     if not isinstance(data, dict):
         return
@@ -366,94 +350,97 @@ async def _combo_delivery_beatriz_job(context: ContextTypes.DEFAULT_TYPE) -> Non
     if not chat_id:
         return
     bot = context.application.bot
-    await _safe_send_message(
-        bot,
-        chat_id=chat_id,
-        user_id=user_id,
-        text="Hi, sorry for the delay. I'll send everything",
-        business_connection_id=bcid,
-    )
-    if AUDIO_ENTREGA_COMBO:
-        await _safe_send_voice_prefer(
-            bot,
+    await _safe_call(
+        lambda: bot.send_message(
             chat_id=chat_id,
-            user_id=user_id,
-            voice=AUDIO_ENTREGA_COMBO,
+            text="Hi, sorry for the delay. I'll send everything",
             business_connection_id=bcid,
+        ),
+        user_id,
+    )
+    # Após a mensagem inicial, áudio, fotos e vídeos não dependem entre si:
+    # envia em paralelo para pagar um único RTT em vez da soma deles
+    sends = []
+    if MEDIA.audio_delivery:
+        sends.append(
+            _safe_send_voice_prefer(
+                bot,
+                chat_id=chat_id,
+                user_id=user_id,
+                voice=MEDIA.audio_delivery,
+                business_connection_id=bcid,
+            )
         )
-    photos_ids = [
-        BEATRIZ_COMBO_FOTO_1,
-        BEATRIZ_COMBO_FOTO_2,
-        BEATRIZ_COMBO_FOTO_3,
-        BEATRIZ_COMBO_FOTO_4,
-        BEATRIZ_COMBO_FOTO_5,
-        BEATRIZ_COMBO_FOTO_6,
-        BEATRIZ_COMBO_FOTO_7,
-        BEATRIZ_COMBO_FOTO_8,
-        BEATRIZ_COMBO_FOTO_9,
-        BEATRIZ_COMBO_FOTO_10,
-    ]
-    photos = [pid for pid in photos_ids if pid]
-    if len(photos) >= 2:
-        media = [InputMediaPhoto(media=pid) for pid in photos]
-        await _safe_send_media_group(
-            bot,
-            chat_id=chat_id,
-            user_id=user_id,
-            media=media,
-            business_connection_id=bcid,
+    if len(MEDIA.combo_photos) >= 2:
+        sends.append(
+            _safe_call(
+                lambda: bot.send_media_group(
+                    chat_id=chat_id,
+                    media=PHOTO_MEDIA,
+                    business_connection_id=bcid,
+                ),
+                user_id,
+            )
         )
-    elif len(photos) == 1:
-        await _safe_send_photo(
-            bot,
-            chat_id=chat_id,
-            user_id=user_id,
-            photo=photos[0],
-            business_connection_id=bcid,
+    elif len(MEDIA.combo_photos) == 1:
+        sends.append(
+            _safe_call(
+                lambda: bot.send_photo(
+                    chat_id=chat_id,
+                    photo=MEDIA.combo_photos[0],
+                    business_connection_id=bcid,
+                ),
+                user_id,
+            )
         )
-    videos_ids = [
-        BEATRIZ_COMBO_VIDEO_1,
-        BEATRIZ_COMBO_VIDEO_2,
-        BEATRIZ_COMBO_VIDEO_3,
-        BEATRIZ_COMBO_VIDEO_4,
-    ]
-    videos = [vid for vid in videos_ids if vid]
-    if len(videos) >= 2:
-        media_v = [InputMediaVideo(media=vid) for vid in videos]
-        await _safe_send_media_group(
-            bot,
-            chat_id=chat_id,
-            user_id=user_id,
-            media=media_v,
-            business_connection_id=bcid,
+    if len(MEDIA.combo_videos) >= 2:
+        sends.append(
+            _safe_call(
+                lambda: bot.send_media_group(
+                    chat_id=chat_id,
+                    media=VIDEO_MEDIA,
+                    business_connection_id=bcid,
+                ),
+                user_id,
+            )
         )
-    elif len(videos) == 1:
-        await _safe_send_video(
-            bot,
-            chat_id=chat_id,
-            user_id=user_id,
-            video=videos[0],
-            business_connection_id=bcid,
+    elif len(MEDIA.combo_videos) == 1:
+        sends.append(
+            _safe_call(
+                lambda: bot.send_video(
+                    chat_id=chat_id,
+                    video=MEDIA.combo_videos[0],
+                    business_connection_id=bcid,
+                ),
+                user_id,
+            )
         )
-    if AUDIO_POS_ENTREGA_COMBO:
+    if sends:
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("Falha ao enviar mídia do combo para chat_id=%s: %r", chat_id, result)
+    if MEDIA.audio_post_delivery:
         await _safe_send_voice_prefer(
             bot,
             chat_id=chat_id,
             user_id=user_id,
-            voice=AUDIO_POS_ENTREGA_COMBO,
+            voice=MEDIA.audio_post_delivery,
             business_connection_id=bcid,
         )
     else:
-        await _safe_send_message(
-            bot,
-            chat_id=chat_id,
-            user_id=user_id,
-            text="Depois que olhar, me fala se gostou, tá bom? 🤍",
-            business_connection_id=bcid,
+        await _safe_call(
+            lambda: bot.send_message(
+                chat_id=chat_id,
+                text="Depois que olhar, me fala se gostou, tá bom? 🤍",
+                business_connection_id=bcid,
+            ),
+            user_id,
         )
-    jobq = getattr(context, "job_queue", None)
+    jobq = context.job_queue
     if jobq:
-        jobq.run_once(
+        _schedule_once(
+            jobq,
             _upsell_sequence_job,
             when=VIP_OFFER_DELAY_SECONDS,
             data={
@@ -466,7 +453,7 @@ async def _combo_delivery_beatriz_job(context: ContextTypes.DEFAULT_TYPE) -> Non
 
 
 async def _upsell_sequence_job(context: ContextTypes.DEFAULT_TYPE) -> None:
-    job = getattr(context, "job", None)
+    job = context.job
     data = job.data if job else {}
     if not isinstance(data, dict):
         return
@@ -476,21 +463,22 @@ async def _upsell_sequence_job(context: ContextTypes.DEFAULT_TYPE) -> None:
     if not chat_id:
         return
     bot = context.application.bot
-    if AUDIO_OFERTANDO_UPSELL:
+    if MEDIA.audio_upsell_offer:
         await _safe_send_voice_prefer(
             bot,
             chat_id=chat_id,
             user_id=user_id,
-            voice=AUDIO_OFERTANDO_UPSELL,
+            voice=MEDIA.audio_upsell_offer,
             business_connection_id=bcid,
         )
-    if VIDEO_PREVIA_VIP:
-        await _safe_send_video(
-            bot,
-            chat_id=chat_id,
-            user_id=user_id,
-            video=VIDEO_PREVIA_VIP,
-            business_connection_id=bcid,
+    if MEDIA.video_vip_preview:
+        await _safe_call(
+            lambda: bot.send_video(
+                chat_id=chat_id,
+                video=MEDIA.video_vip_preview,
+                business_connection_id=bcid,
+            ),
+            user_id,
         )
     upsell_text = (
         "Look at this little preview I sent you 🥰\n"
@@ -502,40 +490,37 @@ async def _upsell_sequence_job(context: ContextTypes.DEFAULT_TYPE) -> None:
         "💎 And much more my dear...\n\n"
         "Now choose a VIP option so you can see me in the best way and cumming for me 💦"
     )
-    await _safe_send_message(
-        bot,
-        chat_id=chat_id,
-        user_id=user_id,
-        text=upsell_text,
-        business_connection_id=bcid,
-    )
-    vip_keyboard = InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("[$10]1 MONTH🔥", url=VIP_LINK_1_MES)],
-            [InlineKeyboardButton("[$17]6 MONTHS+SURPRISE👀🔥", url=VIP_LINK_6_MESES)],
-            [InlineKeyboardButton("[$20]1 YEAR+EXCLUSIVE VIDEO+🎁", url=VIP_LINK_1_ANO)],
-        ]
+    await _safe_call(
+        lambda: bot.send_message(
+            chat_id=chat_id,
+            text=upsell_text,
+            business_connection_id=bcid,
+        ),
+        user_id,
     )
-    await _safe_send_message(
-        bot,
-        chat_id=chat_id,
-        user_id=user_id,
-        text="Choose your VIP below 👇",
-        reply_markup=vip_keyboard,
-        business_connection_id=bcid,
+    await _safe_call(
+        lambda: bot.send_message(
+            chat_id=chat_id,
+            text="Choose your VIP below 👇",
+            reply_markup=VIP_KEYBOARD,
+            business_connection_id=bcid,
+        ),
+        user_id,
     )
-    jobq = getattr(context, "job_queue", None)
+    jobq = context.job_queue
     if jobq and user_id:
-        jobq.run_repeating(
+        delay = _group_check_delay(0, 0)
+        _schedule_once(
+            jobq,
             _group_check_job,
-            interval=GROUP_CHECK_INTERVAL_SECONDS,
-            first=GROUP_CHECK_INTERVAL_SECONDS,
-            name=f"group_check:{chat_id}",
+            when=delay,
+            name=f"group_check:{user_id}",
             data={
                 "chat_id": chat_id,
                 "user_id": user_id,
                 "business_connection_id": bcid,
                 "attempt": 0,
+                "elapsed": delay,
             },
         )
 
@@ -546,44 +531,83 @@ async def _send_remarketing(
     chat_id: int,
     user_id: Optional[int],
     business_connection_id: Optional[str],
+    job_queue=None,
 ) -> None:
-    if AUDIO_REMARKETING_UPSELL:
+    if MEDIA.audio_remarketing:
         await _safe_send_voice_prefer(
             bot,
             chat_id=chat_id,
             user_id=user_id,
-            voice=AUDIO_REMARKETING_UPSELL,
+            voice=MEDIA.audio_remarketing,
             business_connection_id=business_connection_id,
         )
     desc_text = (
         "Okay babe, I've already applied the discount for you 😘\n"
         "Take advantage now, because I'll delete this message later, just click here 👇"
     )
-    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("I WANT THIS 🔥", url=EU_QUERO_LINK)]])
-    await _safe_send_message(
+    await _safe_call(
+        lambda: bot.send_message(
+            chat_id=chat_id,
+            text=desc_text,
+            reply_markup=EU_QUERO_KEYBOARD,
+            business_connection_id=business_connection_id,
+        ),
+        user_id,
+    )
+    if not MEDIA.audio_remarketing_2:
+        return
+    if job_queue:
+        # Agenda o segundo áudio em vez de manter a coroutine dormindo
+        _schedule_once(
+            job_queue,
+            _remarketing_voice2_job,
+            when=REMARKETING_VOICE_2_DELAY_SECONDS,
+            data={
+                "chat_id": chat_id,
+                "user_id": user_id,
+                "business_connection_id": business_connection_id,
+            },
+            name=f"remkt2:{chat_id}",
+        )
+        return
+    try:
+        await asyncio.sleep(REMARKETING_VOICE_2_DELAY_SECONDS)
+    except Exception:
+        return
+    await _safe_send_voice_prefer(
         bot,
         chat_id=chat_id,
         user_id=user_id,
-        text=desc_text,
-        reply_markup=keyboard,
+        voice=MEDIA.audio_remarketing_2,
         business_connection_id=business_connection_id,
     )
-    if AUDIO_REMARKETING_UPSELL_2:
-        try:
-            await asyncio.sleep(45)
-        except Exception:
-            return
-        await _safe_send_voice_prefer(
-            bot,
-            chat_id=chat_id,
-            user_id=user_id,
-            voice=AUDIO_REMARKETING_UPSELL_2,
-            business_connection_id=business_connection_id,
-        )
+
+
+async def _remarketing_voice2_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    job = context.job
+    data = job.data if job else {}
+    if not isinstance(data, dict):
+        return
+    chat_id = data.get("chat_id")
+    if not chat_id or not MEDIA.audio_remarketing_2:
+        return
+    await _safe_send_voice_prefer(
+        context.application.bot,
+        chat_id=chat_id,
+        user_id=data.get("user_id"),
+        voice=MEDIA.audio_remarketing_2,
+        business_connection_id=data.get("business_connection_id"),
+    )
+
+
+def _group_check_delay(attempt: int, elapsed: float) -> float:
+    # Backoff exponencial (60, 120, 240...) limitado ao que resta da janela:
+    # verifica em 60s, 180s e 300s em vez de 5 vezes
+    return min(GROUP_CHECK_INTERVAL_SECONDS * (2**attempt), GROUP_CHECK_WINDOW_SECONDS - elapsed)
 
 
 async def _group_check_job(context: ContextTypes.DEFAULT_TYPE) -> None:
-    job = getattr(context, "job", None)
+    job = context.job
     data = job.data if job else {}
     if not isinstance(data, dict):
         return
@@ -591,12 +615,8 @@ async def _group_check_job(context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = data.get("user_id")
     bcid = data.get("business_connection_id")
     attempt = int(data.get("attempt", 0)) + 1
-    data["attempt"] = attempt
-    if job:
-        job.data = data
+    elapsed = float(data.get("elapsed", 0))
     if not chat_id or not user_id:
-        if job:
-            job.schedule_removal()
         return
     bot = context.application.bot
     is_member = False
@@ -612,25 +632,35 @@ async def _group_check_job(context: ContextTypes.DEFAULT_TYPE) -> None:
         is_member = False
 
     if is_member:
-        await _safe_send_message(
-            bot,
-            chat_id=chat_id,
-            user_id=user_id,
-            text=GROUP_APPROVED_MESSAGE,
-            business_connection_id=bcid,
+        await _safe_call(
+            lambda: bot.send_message(
+                chat_id=chat_id,
+                text=GROUP_APPROVED_MESSAGE,
+                business_connection_id=bcid,
+            ),
+            user_id,
         )
-        if job:
-            job.schedule_removal()
         return
 
-    if attempt >= GROUP_CHECK_MAX_ATTEMPTS:
-        if job:
-            job.schedule_removal()
+    if elapsed >= GROUP_CHECK_WINDOW_SECONDS:
         await _send_remarketing(
             bot,
             chat_id=chat_id,
             user_id=user_id,
             business_connection_id=bcid,
+            job_queue=context.job_queue,
+        )
+        return
+
+    jobq = context.job_queue
+    if jobq:
+        delay = _group_check_delay(attempt, elapsed)
+        _schedule_once(
+            jobq,
+            _group_check_job,
+            when=delay,
+            name=f"group_check:{user_id}",
+            data={**data, "attempt": attempt, "elapsed": elapsed + delay},
         )
 
 
@@ -642,52 +672,49 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = update.effective_user
     if not chat:
         return
+    from_user = message.from_user
+    if from_user is not None and from_user.is_bot:
+        return
     try:
-        from_user = getattr(message, "from_user", None)
-        if from_user is not None and getattr(from_user, "is_bot", False):
-            return
-    except Exception:
-        pass
-    try:
-        is_private = getattr(chat, "type", None) == "private"
-        chat_id = getattr(chat, "id", None)
-        if not is_private or chat_id is None:
+        chat_id = chat.id
+        if chat.type != "private":
             return
-        already_dispatched = bool(context.chat_data.get("combo_dispatched")) or (chat_id in COMBO_DISPATCHED_CHATS)
+        already_dispatched = bool(context.chat_data.get("combo_dispatched")) or _combo_already_dispatched(chat_id)
         if already_dispatched:
             return
         context.chat_data["combo_dispatched"] = True
-        if chat_id is not None:
-            COMBO_DISPATCHED_CHATS.add(chat_id)
+        _mark_combo_dispatched(chat_id)
     except Exception:
         return
-    bcid = getattr(message, "business_connection_id", None)
+    bcid = message.business_connection_id
     if bcid:
         context.chat_data["business_connection_id"] = bcid
-    job_queue = getattr(context, "job_queue", None)
+    uid = user.id if user else None
+    job_queue = context.job_queue
     if not job_queue:
         await asyncio.sleep(AUTO_REPLY_DELAY_SECONDS)
         await _safe_reply_text(message, text="Hi, sorry for the delay. I'll send everything.")
         return
-    job_queue.run_once(
+    _schedule_once(
+        job_queue,
         _combo_delivery_beatriz_job,
         when=AUTO_REPLY_DELAY_SECONDS,
         data={
             "chat_id": chat.id,
-            "user_id": user.id if user else None,
+            "user_id": uid,
             "business_connection_id": bcid,
         },
-        name=f"auto_reply:beatriz:{chat.id}:{getattr(message, 'message_id', 'x')}",
+        name=f"auto_reply:beatriz:{chat.id}",
     )
 
 
 async def business_connection_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    conn = getattr(update, "business_connection", None)
+    conn = update.business_connection
     if not conn:
         return
     try:
-        status = "conectado" if getattr(conn, "is_enabled", False) else "desconectado"
-        print(f"Business connection {conn.id}: {status}")
+        status = "conectado" if conn.is_enabled else "desconectado"
+        logger.info("Business connection %s: %s", conn.id, status)
     except Exception:
         pass
 
@@ -696,10 +723,7 @@ async def handle_attachment(update: Update, context: ContextTypes.DEFAULT_TYPE)
     message = update.effective_message
     if not message:
         return
-    trigger_text = (getattr(message, "caption", None) or getattr(message, "text", None) or "").strip().lower()
-    if "file_id" not in trigger_text:
-        return
-
+    # O gatilho "file_id" já é exigido pelo filtro registrado em _build_application
     replies = []
     if message.document:
         replies.append(f"Documento: {message.document.file_id}")
@@ -719,18 +743,16 @@ async def handle_attachment(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
 async def handle_chat_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    join_request = getattr(update, "chat_join_request", None)
+    join_request = update.chat_join_request
     if not join_request:
         return
-    chat = getattr(join_request, "chat", None)
-    chat_id = getattr(chat, "id", None)
-    if chat_id != SETTINGS.group_id:
+    if join_request.chat.id != SETTINGS.group_id:
         return
     try:
         await join_request.approve()
-        print(f"Join request aprovado para user_id={join_request.from_user.id}")
+        logger.info("Join request aprovado para user_id=%s", join_request.from_user.id)
     except Exception as exc:
-        print(f"Falha ao aprovar join request: {exc}")
+        logger.warning("Falha ao aprovar join request: %s", exc)
 
 
 # ========================
@@ -738,23 +760,35 @@ async def handle_chat_join_request(update: Update, context: ContextTypes.DEFAULT
 # ========================
 
 
+# Corpos de resposta fixos, serializados uma única vez
+_HEALTH_OK_BYTES = b'{"status":"ok"}'
+_OK_BYTES = b'{"ok":true}'
+_INVALID_JSON_BYTES = b'{"ok":false,"error":"invalid_json"}'
+_INVALID_UPDATE_BYTES = b'{"ok":false,"error":"invalid_update"}'
+
+
 async def _healthcheck_handler(request: web.Request) -> web.Response:
-    return web.json_response({"status": "ok"})
+    return web.Response(body=_HEALTH_OK_BYTES, content_type="application/json")
+
+
+# Decoder reutilizado entre requisições (mais rápido que o json da stdlib)
+_UPDATE_DECODER = msgspec.json.Decoder(dict)
 
 
 # --- Handlers de Webhook do Telegram ---
 async def _telegram_update_handler(request: web.Request) -> web.Response:
     application: Application = request.app["telegram_application"]
     try:
-        data = await request.json()
+        data = _UPDATE_DECODER.decode(await request.read())
     except Exception:
-        return web.json_response({"ok": False, "error": "invalid_json"}, status=400)
+        return web.Response(body=_INVALID_JSON_BYTES, status=400, content_type="application/json")
     try:
         update = Update.de_json(data, application.bot)
-        await application.update_queue.put(update)
     except Exception:
-        return web.json_response({"ok": False, "error": "invalid_update"}, status=400)
-    return web.json_response({"ok": True})
+        return web.Response(body=_INVALID_UPDATE_BYTES, status=400, content_type="application/json")
+    # Despacha no próprio task da requisição, sem o salto pela update_queue
+    await application.process_update(update)
+    return web.Response(body=_OK_BYTES, content_type="application/json")
 
 
 # ========================
@@ -762,12 +796,44 @@ async def _telegram_update_handler(request: web.Request) -> web.Response:
 # ========================
 
 
+# Só despacha anexos cuja legenda/texto contenha "file_id" (sem diferenciar caixa)
+FILE_ID_TRIGGER_FILTER = filters.ATTACHMENT & (
+    filters.CaptionRegex(r"(?i)file_id") | filters.Regex(r"(?i)file_id")
+)
+
+
 def _build_application() -> Application:
-    app = ApplicationBuilder().token(SETTINGS.token).build()
-    app.add_handler(BusinessConnectionHandler(business_connection_handler))
-    app.add_handler(ChatJoinRequestHandler(handle_chat_join_request))
-    app.add_handler(MessageHandler(filters.ChatType.PRIVATE, handle_text_message))
-    app.add_handler(MessageHandler(filters.ATTACHMENT, handle_attachment))
+    app = (
+        ApplicationBuilder()
+        .token(SETTINGS.token)
+        .concurrent_updates(True)
+        # Respeita o limite global (~30 msg/s) enfileirando em vez de estourar 429
+        .rate_limiter(AIORateLimiter(overall_max_rate=30, overall_time_period=1, max_retries=3))
+        # Pool grande com keep-alive e HTTP/2 para os envios concorrentes dos jobs
+        .request(
+            HTTPXRequest(
+                connection_pool_size=256,
+                pool_timeout=30.0,
+                connect_timeout=10.0,
+                read_timeout=30.0,
+                http_version="2",
+            )
+        )
+        .get_updates_request(
+            HTTPXRequest(
+                connection_pool_size=8,
+                pool_timeout=30.0,
+                connect_timeout=10.0,
+                read_timeout=30.0,
+            )
+        )
+        .build()
+    )
+    # block=False: o callback roda como task e o despacho retorna na hora
+    app.add_handler(BusinessConnectionHandler(business_connection_handler, block=False))
+    app.add_handler(ChatJoinRequestHandler(handle_chat_join_request, block=False))
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE, handle_text_message, block=False))
+    app.add_handler(MessageHandler(FILE_ID_TRIGGER_FILTER, handle_attachment, block=False))
     return app
 
 
@@ -780,7 +846,21 @@ def _build_web_app(application: Application) -> web.Application:
     return web_app
 
 
+def _setup_logging() -> logging.handlers.QueueListener:
+    # O loop só enfileira os registros; a escrita no stdout fica numa thread à parte
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.WARNING)
+    listener.start()
+    return listener
+
+
 async def main() -> None:
+    log_listener = _setup_logging()
     port = int(os.getenv("PORT", "8080"))
     application = _build_application()
     web_app = _build_web_app(application)
@@ -788,7 +868,6 @@ async def main() -> None:
     runner = web.AppRunner(web_app)
     await runner.setup()
     site = web.TCPSite(runner, host="0.0.0.0", port=port)
-    await site.start()
 
     await application.initialize()
 
@@ -804,12 +883,15 @@ async def main() -> None:
     try:
         if webhook_base:
             full_webhook_url = f"{webhook_base.rstrip('/')}{webhook_path}"
+            await application.start()
+            # Só abre a porta com a aplicação rodando (o webhook despacha direto
+            # via process_update) e só registra o webhook com a porta já aberta
+            await site.start()
             await application.bot.set_webhook(
                 url=full_webhook_url,
                 allowed_updates=Update.ALL_TYPES,
                 drop_pending_updates=True,
             )
-            await application.start()
             try:
                 while True:
                     await asyncio.sleep(3600)
@@ -821,6 +903,7 @@ async def main() -> None:
             except Exception:
                 pass
             await application.start()
+            await site.start()
             try:
                 await application.updater.start_polling(
                     allowed_updates=Update.ALL_TYPES,
@@ -831,6 +914,11 @@ async def main() -> None:
             except asyncio.CancelledError:
                 pass
     finally:
+        # Fecha o servidor primeiro para nenhum update chegar à aplicação parando
+        try:
+            await runner.cleanup()
+        except Exception:
+            pass
         try:
             if application.updater:
                 await application.updater.stop()
@@ -844,11 +932,15 @@ async def main() -> None:
             await application.shutdown()
         except Exception:
             pass
-        try:
-            await runner.cleanup()
-        except Exception:
-            pass
+        log_listener.stop()
 
 
 if __name__ == "__main__":
+    # uvloop é opcional (não existe no Windows); sem ele usa o loop padrão
+    try:
+        import uvloop  # type: ignore
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     asyncio.run(main())